@@ -1,7 +1,9 @@
 import streamlit as st
-import json
+import orjson
 import time
-import requests 
+import random
+import httpx
+from concurrent.futures import ThreadPoolExecutor
 
 # --- 1. CONFIGURATION AND CONSTANTS ---
 
@@ -16,6 +18,41 @@ MODEL_NAME = "gemini-2.5-flash-preview-09-2025"
 if not API_KEY and hasattr(st, 'secrets'):
     API_KEY = st.secrets.get("GEMINI_API_KEY", "")
 
+# Construct API URL once using the constants MODEL_NAME and API_KEY
+API_ENDPOINT_TEMPLATE = "https://generativelanguage.googleapis.com/v1beta/models/{model}:streamGenerateContent?alt=sse&key={key}"
+API_URL = API_ENDPOINT_TEMPLATE.format(model=MODEL_NAME, key=API_KEY)
+
+
+@st.cache_resource
+def get_client():
+    """
+    Returns the HTTP/2 client shared by all reruns and user sessions. Concurrent requests
+    (e.g. the suggestion prewarm) are multiplexed over one kept-alive TLS connection.
+    Retries are handled by our own backoff loop.
+    """
+    return httpx.Client(
+        http2=True,
+        headers={'Content-Type': 'application/json'},
+        timeout=httpx.Timeout(60.0, connect=10.0),
+        limits=httpx.Limits(max_keepalive_connections=8),
+    )
+
+
+# Define the persona and constraints for the LLM
+SYSTEM_PROMPT = (
+    "You are a helpful, professional, and medically aware assistant specializing in hypertension "
+    "and blood pressure management. Provide a concise, easy-to-understand answer based on the information "
+    "you find. When discussing medical topics, explicitly advise the user to consult a doctor for diagnosis or treatment."
+)
+
+# The request body only varies by the user's query, so serialize the static part once and
+# splice the JSON-escaped query in per request.
+PAYLOAD_PREFIX = orjson.dumps({
+    "tools": [{"google_search": {} }], # Enable Google Search for grounding
+    "systemInstruction": {"parts": [{"text": SYSTEM_PROMPT}]},
+})[:-1] + b',"contents":[{"parts":[{"text":'
+PAYLOAD_SUFFIX = b'}]}]}'
+
 
 meta = {
     "initial_greeting": "👋 Hi! I'm your **Hypertension Assistant**. I use advanced AI to answer your questions about high blood pressure. Ask away!",
@@ -31,97 +68,229 @@ suggestions = [
     "Explain the difference between systolic and diastolic pressure."
 ]
 
+# Maximum number of answers remembered per user session (oldest evicted first)
+SESSION_CACHE_SIZE = 32
+
+# Maximum number of chat messages kept in the session (the initial greeting is always kept)
+MAX_MESSAGES = 50
+
+# Stored message role -> (st.chat_message name, avatar), resolved once instead of per bubble
+CHAT_ROLES = {
+    "user": ("user", "🧑"),
+    "bot": ("assistant", "🤖"),
+}
+
 
 # --- 2. GEMINI API COMMUNICATION ---
 
-def get_gemini_response(query):
+class GeminiAPIError(Exception):
+    """Raised when the Gemini API cannot produce a response (missing key or failed retries)."""
+
+
+def _format_citations(sources):
+    """Formats up to three unique grounding sources as a Markdown list."""
+    # uri -> title; the dict keeps first-seen order and drops duplicate URIs in one pass
+    unique = {}
+    for source in sources:
+        web = source.get('web', {})
+        if web.get('uri'):
+            unique.setdefault(web['uri'], web.get('title', 'Link'))
+
+    top = list(unique.items())[:3]
+    if not top:
+        return ""
+    return "\n\n---\n**Sources:**\n" + "\n".join(f"- [{title}]({uri})" for uri, title in top) + "\n"
+
+
+def _stream_gemini(query):
     """
-    Generates a response using the Gemini API with Google Search grounding.
-    Uses exponential backoff for retries.
+    Streams a response from the Gemini API (Server-Sent Events) with Google Search grounding.
+    Yields text chunks as they arrive, followed by the citations once the stream ends.
+    Uses exponential backoff for retries while establishing the connection.
+
+    This generator has no UI side effects; failures are raised as GeminiAPIError.
     """
     # Check if API Key is available
     if not API_KEY:
-        st.error("API Key is missing. Please ensure it is set up correctly in your environment (Canvas or local secrets).")
-        return meta['api_fail']
-        
-    # Construct API URL dynamically using the constant MODEL_NAME and API_KEY
-    API_ENDPOINT_TEMPLATE = "https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent?key={key}"
-    api_url = API_ENDPOINT_TEMPLATE.format(model=MODEL_NAME, key=API_KEY)
-    
-    # Define the persona and constraints for the LLM
-    system_prompt = (
-        "You are a helpful, professional, and medically aware assistant specializing in hypertension "
-        "and blood pressure management. Provide a concise, easy-to-understand answer based on the information "
-        "you find. When discussing medical topics, explicitly advise the user to consult a doctor for diagnosis or treatment."
-    )
+        raise GeminiAPIError("API Key is missing. Please ensure it is set up correctly in your environment (Canvas or local secrets).")
 
-    payload = {
-        "contents": [{"parts": [{"text": query}]}],
-        "tools": [{"google_search": {} }], # Enable Google Search for grounding
-        "systemInstruction": {"parts": [{"text": system_prompt}]},
-    }
+    body = PAYLOAD_PREFIX + orjson.dumps(query) + PAYLOAD_SUFFIX
+    client = get_client()
 
-    headers = {'Content-Type': 'application/json'}
     max_retries = 3
+    max_backoff = 8 # Upper bound (seconds) on a single backoff sleep
 
     for attempt in range(max_retries):
         try:
-            response = requests.post(api_url, headers=headers, data=json.dumps(payload), timeout=20)
+            response = client.send(client.build_request("POST", API_URL, content=body), stream=True)
+            if response.is_success:
+                break
+            response.close()
             response.raise_for_status() # Raise exception for bad status codes (4xx or 5xx)
-            
-            result = response.json()
-            candidate = result.get('candidates', [{}])[0]
-            
-            if candidate and candidate.get('content') and candidate['content']['parts']:
-                text = candidate['content']['parts'][0].get('text', meta['placeholder_fail'])
-                
-                # Extract grounding sources
-                sources = []
-                grounding_metadata = candidate.get('groundingMetadata')
-                if grounding_metadata and grounding_metadata.get('groundingAttributions'):
-                    sources = grounding_metadata['groundingAttributions']
-                
-                citations = ""
-                if sources:
-                    citations = "\n\n---\n**Sources:**\n"
-                    unique_uris = set()
-                    
-                    for source in sources:
-                        uri = source.get('web', {}).get('uri')
-                        title = source.get('web', {}).get('title', 'Link')
-                        
-                        if uri and uri not in unique_uris:
-                            citations += f"- [{title}]({uri})\n"
-                            unique_uris.add(uri)
-                            if len(unique_uris) >= 3:
-                                break
-                                
-                return text + citations
-
-        except (requests.exceptions.RequestException, json.JSONDecodeError) as e:
-            # Use exponential backoff
+
+        except httpx.HTTPError as e:
+            # Client errors (bad key, bad request, unknown model) will not succeed on retry;
+            # only request timeouts (408) and rate limiting (429) are worth another attempt
+            status = getattr(getattr(e, 'response', None), 'status_code', None)
+            if status and 400 <= status < 500 and status not in (408, 429):
+                raise GeminiAPIError(f"Gemini API returned {status}.") from e
+
+            # Use exponential backoff with full jitter so concurrent sessions don't retry in lockstep
             if attempt < max_retries - 1:
-                wait_time = 2 ** attempt
-                time.sleep(wait_time)
+                time.sleep(random.uniform(0, min(2 ** attempt, max_backoff)))
             else:
-                # If all retries fail, return the API fail message
-                st.error(f"Failed to connect to Gemini API after {max_retries} attempts.")
-                return meta['api_fail']
-            
-    return meta['placeholder_fail']
+                # If all retries fail, raise so the failure is not cached
+                raise GeminiAPIError(f"Failed to connect to Gemini API after {max_retries} attempts.") from e
+
+    has_text = False
+    sources = []
+
+    try:
+        # Each event is a single line of the form "data: {...GenerateContentResponse...}"
+        for line in response.iter_lines():
+            if not line.startswith("data:"):
+                continue
+
+            chunk = orjson.loads(line[len("data:"):])
+            candidates = chunk.get('candidates')
+            if not candidates:
+                # Blocked query (HTTP 200 with only promptFeedback): nothing more will arrive and
+                # retrying won't change the outcome, so stop reading and fall back to the placeholder
+                break
+            candidate = candidates[0]
+
+            for part in candidate.get('content', {}).get('parts', []):
+                if part.get('text'):
+                    has_text = True
+                    yield part['text']
+
+            # Grounding sources are attached to the candidate, typically on the final chunk
+            grounding_metadata = candidate.get('groundingMetadata')
+            if grounding_metadata and grounding_metadata.get('groundingAttributions'):
+                sources = grounding_metadata['groundingAttributions']
+
+    except (httpx.HTTPError, orjson.JSONDecodeError) as e:
+        raise GeminiAPIError("The connection to the Gemini API was interrupted.") from e
+    finally:
+        response.close()
+
+    if not has_text:
+        yield meta['placeholder_fail']
+        return
+
+    yield _format_citations(sources)
+
+
+@st.cache_data(ttl=3600, max_entries=256, show_spinner=False)
+def _call_gemini(query):
+    """
+    Returns the complete Gemini response for a query.
+
+    The result is cached; failures are raised as GeminiAPIError, which keeps them out of the cache.
+    The cache is shared by every user, so it is only used for the fixed `suggestions`. Typed
+    questions go through _buffer_stream and are memoized per session only, so one user's question
+    and answer are never served to (or timed by) another user.
+    """
+    return "".join(_stream_gemini(query))
+
+
+def _buffer_stream(query, chunks):
+    """
+    Consumes the Gemini stream (typically in a worker thread), appending each chunk to
+    `chunks` so the UI can render the partial answer while it is still being generated.
+    Deliberately uncached: see _call_gemini for why typed questions stay out of the shared cache.
+    """
+    for chunk in _stream_gemini(query):
+        chunks.append(chunk)
+    return "".join(chunks)
+
+
+@st.cache_resource
+def get_executor():
+    """Returns the worker pool that runs Gemini calls off the script thread, shared by all sessions."""
+    return ThreadPoolExecutor(max_workers=8)
+
+
+@st.cache_resource
+def _prewarm_suggestions():
+    """
+    Starts answering all suggestions concurrently, once per process, so a click can reuse the
+    already finished (or in-flight) request. Returns a dict of suggestion -> Future.
+    """
+    executor = get_executor()
+    return {sug: executor.submit(_call_gemini, sug) for sug in suggestions}
 
 
 # --- 3. STREAMLIT UI AND CHAT LOGIC ---
 
+@st.cache_data(ttl=None, show_spinner=False)
+def _load_css(path):
+    """Reads a stylesheet once per process instead of on every rerun."""
+    with open(path) as f:
+        return f.read()
+
+
+def _chat_message(role):
+    """Opens a chat bubble for a stored message role ("user" or "bot")."""
+    name, avatar = CHAT_ROLES[role]
+    return st.chat_message(name, avatar=avatar)
+
+
+def _append_message(role, text):
+    """Appends a chat message, dropping the oldest turns (after the greeting) beyond MAX_MESSAGES."""
+    messages = st.session_state.messages
+    messages.append({"role": role, "text": text})
+    if len(messages) > MAX_MESSAGES:
+        del messages[1:len(messages) - (MAX_MESSAGES - 1)]
+
+
+@st.fragment(run_every=0.3)
+def _render_pending():
+    """
+    Polls the in-flight Gemini request, showing the partial answer until it completes.
+    Only this fragment reruns while waiting, so the rest of the page stays responsive.
+    """
+    pending = st.session_state.get("pending")
+    if pending is None:
+        return
+
+    future = pending["future"]
+    if not future.done():
+        with _chat_message("bot"):
+            st.markdown("".join(pending["chunks"]) or "_Searching and synthesizing an answer via Gemini..._")
+        return
+
+    # Cleared before reading the result so a failure can never leave the session stuck polling
+    del st.session_state.pending
+
+    try:
+        response = future.result()
+    except Exception as e:
+        # Not `except GeminiAPIError`: every rerun redefines that class, so an error raised by a
+        # future from an earlier run wouldn't match. Shown on the next full rerun, since this
+        # fragment's output is about to be replaced.
+        st.session_state.api_error = str(e) or "Unexpected error while contacting the Gemini API."
+        response = meta['api_fail']
+    else:
+        # Remember the answer for this session only, so repeated questions skip the API
+        cache = st.session_state.setdefault("_qcache", {})
+        cache[pending["query"]] = response
+        if len(cache) > SESSION_CACHE_SIZE:
+            cache.pop(next(iter(cache)))
+
+    _append_message("bot", response)
+    st.rerun()
+
+
 def app():
     """Renders the Streamlit application."""
     st.set_page_config(page_title="Hypertension Assistant 💬", page_icon="💉", layout="centered")
 
     # Inject external CSS from gui_style.css
     try:
-        # Load the content of the CSS file
-        with open("gui_style.css") as f:
-            st.markdown(f"<style>{f.read()}</style>", unsafe_allow_html=True)
+        # Load the content of the CSS file (cached)
+        css = _load_css("gui_style.css")
+        st.markdown(f"<style>{css}</style>", unsafe_allow_html=True)
     except FileNotFoundError:
         st.warning("Could not load 'gui_style.css'. Displaying unstyled content. Make sure 'gui_style.css' is present.")
 
@@ -130,48 +299,65 @@ def app():
     st.write("I'm here to help you learn and manage your blood pressure effectively. **All information is AI-generated and grounded in search results. Always consult your doctor.** 🩺")
     st.divider()
 
+    # Kick off the suggestion answers in the background (no-op after the first run)
+    prewarmed = _prewarm_suggestions()
+
     # Session chat history initialization
     if "messages" not in st.session_state:
         st.session_state.messages = [{"role": "bot", "text": meta["initial_greeting"]}]
 
+    # Surface any API failure from the last completed request
+    if "api_error" in st.session_state:
+        st.error(st.session_state.pop("api_error"))
+
     # Chat display (Scrollable)
     chat_container = st.container(height=400)
     with chat_container:
         for chat in st.session_state.messages:
-            if chat["role"] == "user":
-                st.markdown(f"<div class='user-bubble'>🧑‍💬 {chat['text']}</div>", unsafe_allow_html=True)
-            else:
-                st.markdown(f"<div class='bot-bubble'>🤖 {chat['text']}</div>", unsafe_allow_html=True)
+            with _chat_message(chat["role"]):
+                st.markdown(chat["text"])
+
+        # Bot response still being generated in the background
+        if "pending" in st.session_state:
+            _render_pending()
 
     # Function to process chat logic and update messages
-    def process_query(user_query):
-        if not user_query:
+    def process_query(user_query, stream=True):
+        if not user_query or "pending" in st.session_state:
             return
         
         # 1. Append user message
-        st.session_state.messages.append({"role": "user", "text": user_query})
-        
-        # 2. Get AI response using spinner
-        with st.spinner("Searching and synthesizing an answer via Gemini..."):
-            response = get_gemini_response(user_query)
+        _append_message("user", user_query)
+
+        # Answer repeated questions from this session's memo without another request. This memo is
+        # the only cache typed questions get; the shared st.cache_data serves suggestions only.
+        cache = st.session_state.setdefault("_qcache", {})
+        if user_query in cache:
+            _append_message("bot", cache[user_query])
+            st.rerun()
         
-        # 3. Append bot response
-        st.session_state.messages.append({"role": "bot", "text": response})
+        # 2. Dispatch the AI request to a worker thread; _render_pending picks up the result
+        chunks = []
+        if stream:
+            # Typed question: streamed live and kept out of the process-wide cache
+            future = get_executor().submit(_buffer_stream, user_query, chunks)
+        else:
+            # Suggestions reuse the prewarmed request unless it failed, then fall back to a live call
+            future = prewarmed.get(user_query)
+            if future is None or (future.done() and future.exception() is not None):
+                future = get_executor().submit(_call_gemini, user_query)
+        st.session_state.pending = {"query": user_query, "future": future, "chunks": chunks}
 
-    # --- Input field and Send button ---
-    
-    # Use clear_on_submit=True to natively clear the text input.
-    with st.form(key='chat_form', clear_on_submit=True): 
-        col1, col2 = st.columns([6, 1])
-        with col1:
-            user_input = st.text_input("Type your question...", key="user_input_text", label_visibility="collapsed")
-        with col2:
-            submitted = st.form_submit_button("Send")
+        # 3. Rerun so the new message and the pending answer are rendered, with input disabled
+        st.rerun()
+
+    busy = "pending" in st.session_state
+
+    # --- Input field ---
     
-    # Process form submission outside the form block
-    if submitted:
-        process_query(st.session_state.user_input_text)
-        st.rerun() 
+    # st.chat_input clears itself on submit and triggers the rerun natively.
+    if prompt := st.chat_input("Type your question...", disabled=busy):
+        process_query(prompt)
 
     # --- Suggestion buttons ---
     st.write("### 💡 Try asking:")
@@ -179,9 +365,8 @@ def app():
     cols = st.columns(3) 
     
     for i, sug in enumerate(suggestions):
-        if cols[i % 3].button(sug, key=f"sug_btn_{i}"):
-            process_query(sug)
-            st.rerun()
+        if cols[i % 3].button(sug, key=f"sug_btn_{i}", disabled=busy):
+            process_query(sug, stream=False)
 
             
 if __name__ == "__main__":
@@ -0,0 +1,34 @@
+import time
+from pathlib import Path
+
+from streamlit.testing.v1 import AppTest
+
+APP_PATH = str(Path(__file__).resolve().parent.parent / "main.py")
+
+
+def _run_until_answered(at, timeout=10):
+    """Reruns the app until the background request has been picked up by _render_pending."""
+    deadline = time.monotonic() + timeout
+    while "pending" in at.session_state and time.monotonic() < deadline:
+        time.sleep(0.05)
+        at.run()
+
+
+def test_app_recovers_from_api_failure():
+    # An empty GEMINI_API_KEY makes every request fail with GeminiAPIError
+    at = AppTest.from_file(APP_PATH, default_timeout=10)
+    at.secrets["GEMINI_API_KEY"] = ""
+    at.run()
+    assert not at.exception
+
+    at.chat_input[0].set_value("What is hypertension?").run()
+    _run_until_answered(at)
+
+    assert not at.exception
+    assert "pending" not in at.session_state
+    assert "API Key is missing" in at.error[0].value
+    assert at.session_state.messages[-1]["text"].startswith("⚠️ I'm sorry, I cannot connect")
+
+    # Input is usable again after the failure
+    assert not at.chat_input[0].disabled
+    assert all(not button.disabled for button in at.button)